@@ -1,4 +1,7 @@
 # fraud_detection.py
+import os
+import sys
+import threading
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
@@ -6,7 +9,10 @@ from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import classification_report
 from flask import Flask, render_template, request, jsonify
-import pickle
+
+# The model format and scoring kernels live with the gRPC ML service (fraud_ml/forest.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'fraud_ml'))
+from forest import FOREST_ARRAYS, flatten_forest, load_tensors, save_tensors, score_rows
 
 # --- Simulated Data Generation (since we don’t have real transaction data) ---
 def generate_sample_data(n_samples=1000):
@@ -39,75 +45,84 @@ def preprocess_and_train():
     X_train, X_test, y_train, y_test = train_test_split(X_scaled, y, test_size=0.2, random_state=42)
     
     # Train model
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    model = RandomForestClassifier(n_estimators=100, max_depth=8, n_jobs=1, random_state=42)
     model.fit(X_train, y_train)
     
     # Evaluate
     y_pred = model.predict(X_test)
     print("Model Performance:\n", classification_report(y_test, y_pred))
     
-    # Save model and scaler
-    with open('model.pkl', 'wb') as f:
-        pickle.dump(model, f)
-    with open('scaler.pkl', 'wb') as f:
-        pickle.dump(scaler, f)
+    # Save model (as flat tree arrays) and scaler parameters
+    tensors = flatten_forest(model)
+    tensors['mean'] = scaler.mean_
+    tensors['scale'] = scaler.scale_
+    save_tensors(tensors, 'model.safetensors')
     
     return model, scaler, features
 
-# --- Flask App ---
-app = Flask(__name__)
-
-# Load model and scaler
-try:
-    with open('model.pkl', 'rb') as f:
-        model = pickle.load(f)
-    with open('scaler.pkl', 'rb') as f:
-        scaler = pickle.load(f)
-except:
-    model, scaler, features = preprocess_and_train()
+# --- Model Loading ---
+def load_artifacts():
+    """Load the flattened forest and scaler parameters, training a new model if missing"""
+    try:
+        tensors = load_tensors()
+    except FileNotFoundError:
+        preprocess_and_train()
+        tensors = load_tensors()
+    forest = tuple(tensors[name] for name in FOREST_ARRAYS)
+    # Score a dummy row so loading/compiling the kernel isn't paid by the first request
+    n_features = tensors['mean'].shape[0]
+    score_rows(np.zeros((1, n_features)), tensors['mean'], 1.0 / tensors['scale'], *forest)
+    return forest, tensors['mean'], tensors['scale']
 
 # Define features used in the model
 features = ['amount', 'time', 'merchant_risk', 'user_history', 'amount_to_history_ratio']
 
-@app.route('/')
-def home():
-    return render_template('index.html')
+# --- Flask App ---
+def create_app():
+    """Build the Flask app with the model loaded once, before any worker forks"""
+    app = Flask(__name__)
+    forest, scaler_mean, scaler_scale = load_artifacts()
+    # Scaling is fused into the kernel as (x - mean) * (1 / scale)
+    scaler_inv_scale = 1.0 / scaler_scale
+    # Per-thread input row, filled in place on every request
+    local = threading.local()
 
-@app.route('/predict', methods=['POST'])
-@app.route('/predict', methods=['POST'])
-@app.route('/predict', methods=['POST'])
-def predict():
-    data = request.form.to_dict()
-    amount = float(data['amount'])
-    time = float(data['time'])
-    merchant_risk = float(data['merchant_risk'])
-    user_history = float(data['user_history'])
-    
-    amount_to_history_ratio = amount / user_history
-    
-    input_data = np.array([[amount, time, merchant_risk, user_history, amount_to_history_ratio]])
-    input_scaled = scaler.transform(input_data)
-    
-    prediction = model.predict(input_scaled)[0]
-    probability = model.predict_proba(input_scaled)[0][1]
-    
-    # Additional rule: High amount + low history = suspicious
-    if amount > 800 and user_history < 5:
-        result = 'Fraudulent'
-        probability = max(probability, 0.9)  # Boost probability
-    else:
-        result = 'Fraudulent' if prediction == 1 else 'Legitimate'
-    
-    return jsonify({'result': result, 'probability': round(probability * 100, 2)})
+    @app.route('/')
+    def home():
+        return render_template('index.html')
+
+    @app.route('/predict', methods=['POST'])
+    def predict():
+        data = request.form.to_dict()
+        amount = float(data['amount'])
+        time = float(data['time'])
+        merchant_risk = float(data['merchant_risk'])
+        user_history = float(data['user_history'])
+        
+        amount_to_history_ratio = amount / user_history
+        
+        input_data = getattr(local, 'input_data', None)
+        if input_data is None:
+            input_data = local.input_data = np.empty((1, len(features)))
+        input_data[0] = amount, time, merchant_risk, user_history, amount_to_history_ratio
+        probability = float(score_rows(input_data, scaler_mean, scaler_inv_scale, *forest)[0])
+        
+        # Additional rule: High amount + low history = suspicious
+        if amount > 800 and user_history < 5:
+            result = 'Fraudulent'
+            probability = max(probability, 0.9)  # Boost probability
+        else:
+            # Same tie-break as the forest's argmax over class probabilities
+            result = 'Fraudulent' if probability > 0.5 else 'Legitimate'
+        
+        return jsonify({'result': result, 'probability': round(probability * 100, 2)})
+
+    return app
+
+# Production: gunicorn -c gunicorn.conf.py fraud_detection:app
+app = create_app()
 
 # --- Main Execution ---
 if __name__ == '__main__':
-    # Train model if not already trained
-    try:
-        with open('model.pkl', 'rb') as f:
-            pass
-    except:
-        preprocess_and_train()
-    
-    # Run Flask app
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    # Local development server only
+    app.run(port=5001)
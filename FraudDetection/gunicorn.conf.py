@@ -0,0 +1,13 @@
+# gunicorn.conf.py
+# Usage: gunicorn -c gunicorn.conf.py fraud_detection:app
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5001')
+
+# Threaded workers; the compiled scoring kernel runs without the GIL
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+threads = int(os.getenv('THREADS', 8))
+
+# Load the model in the master before forking so workers share its pages
+preload_app = True
@@ -0,0 +1,136 @@
+"""Flattened random forest: the on-disk model format and the compiled scoring kernels.
+
+Shared by the gRPC ML service (server.py) and the Flask demo app
+(FraudDetection/fraud_detection.py), which both read model.safetensors.
+"""
+import json
+import os
+import tempfile
+import numpy as np
+from numba import njit
+from safetensors.numpy import save_file
+
+# Flat node arrays, in the argument order expected by forest_proba
+FOREST_ARRAYS = ['feature', 'threshold', 'left', 'right', 'value', 'tree_starts']
+
+def hot_path_order(tree):
+    """Depth-first node order that always descends into the child more training rows took first"""
+    # Bootstrap-weighted training rows that reached each node, i.e. the branch frequencies
+    counts = tree.weighted_n_node_samples
+    order = []
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        order.append(node)
+        left, right = tree.children_left[node], tree.children_right[node]
+        if left >= 0:
+            # Push the hot child last so it is popped next and lands right after its parent
+            stack.extend((right, left) if counts[left] >= counts[right] else (left, right))
+    return np.array(order)
+
+def float32_floor(values):
+    """Largest float32 <= each value: for float32 x, x <= result exactly when x <= value"""
+    rounded = values.astype(np.float32)
+    return np.where(rounded > values, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+def flatten_forest(model):
+    """Concatenate every tree's nodes into flat arrays indexed by global node id.
+
+    Each tree is laid out along its hot path, so the likely branch at every
+    split is usually the next node in memory.
+    """
+    arrays = {name: [] for name in FOREST_ARRAYS}
+    start = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        order = hot_path_order(tree)
+        new_id = np.empty(tree.node_count, dtype=np.int64)
+        new_id[order] = start + np.arange(tree.node_count)
+        is_leaf = tree.children_left[order] < 0
+        arrays['feature'].append(tree.feature[order])
+        # Inputs are float32, so float32 thresholds (rounded down) keep every split decision
+        arrays['threshold'].append(float32_floor(tree.threshold[order]))
+        arrays['left'].append(np.where(is_leaf, -1, new_id[tree.children_left[order]]))
+        arrays['right'].append(np.where(is_leaf, -1, new_id[tree.children_right[order]]))
+        # Fraud-class probability at each node (only read at leaves)
+        arrays['value'].append(tree.value[order, 0, 1] / tree.value[order, 0, :].sum(axis=1))
+        arrays['tree_starts'].append([start])
+        start += tree.node_count
+    dtypes = {'feature': np.int32, 'threshold': np.float32, 'left': np.int32,
+              'right': np.int32, 'value': np.float32, 'tree_starts': np.int32}
+    return {name: np.concatenate(arrays[name]).astype(dtypes[name]) for name in FOREST_ARRAYS}
+
+# Tensor dtypes flatten_forest and the scaler produce
+SAFETENSORS_DTYPES = {'F64': np.float64, 'F32': np.float32, 'I64': np.int64, 'I32': np.int32}
+
+def load_tensors(path='model.safetensors'):
+    """Memory-map every tensor in a safetensors file as a read-only array.
+
+    Pages are loaded on demand and shared between processes mapping the same
+    file; nothing is copied and no code runs on load.
+    """
+    with open(path, 'rb') as f:
+        header_size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(header_size))
+    header.pop('__metadata__', None)
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=8 + header_size)
+    tensors = {}
+    for name, info in header.items():
+        begin, end = info['data_offsets']
+        tensor = data[begin:end].view(SAFETENSORS_DTYPES[info['dtype']]).reshape(info['shape'])
+        # Plain ndarray view (still zero-copy) so Numba's dispatch takes its fast path
+        tensors[name] = np.asarray(tensor)
+    return tensors
+
+def save_tensors(tensors, path='model.safetensors'):
+    """Write tensors to path atomically.
+
+    Readers memory-map the file, so it is never rewritten in place (truncating
+    a mapped file raises SIGBUS in every process mapping it): the tensors go to
+    a temporary file in the same directory, which then replaces path.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    os.close(fd)
+    try:
+        save_file(tensors, tmp_path)
+        os.chmod(tmp_path, 0o644)  # mkstemp creates it owner-only
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+@njit(cache=True, nogil=True)
+def forest_proba(features_scaled, feature, threshold, left, right, value, tree_starts):
+    """Average fraud probability over all trees for each scaled float32 row.
+
+    Trees are the outer loop so one tree's nodes stay in cache while
+    every row of a batch walks it.
+    """
+    n_rows = features_scaled.shape[0]
+    n_trees = tree_starts.shape[0]
+    totals = np.zeros(n_rows, dtype=np.float64)
+    for t in range(n_trees):
+        root = tree_starts[t]
+        for i in range(n_rows):
+            node = root
+            while feature[node] >= 0:
+                if features_scaled[i, feature[node]] <= threshold[node]:
+                    node = left[node]
+                else:
+                    node = right[node]
+            totals[i] += value[node]
+    return (totals / n_trees).astype(np.float32)
+
+@njit(cache=True, nogil=True)
+def score_rows(rows, mean, inv_scale, feature, threshold, left, right, value, tree_starts):
+    """Scale raw float64 rows and score them with forest_proba.
+
+    Scaling happens in float64 and is then rounded to float32, the same
+    precision sklearn's trees compare at, so split decisions match sklearn.
+    """
+    n_rows, n_features = rows.shape
+    features_scaled = np.empty((n_rows, n_features), dtype=np.float32)
+    for i in range(n_rows):
+        for j in range(n_features):
+            features_scaled[i, j] = (rows[i, j] - mean[j]) * inv_scale[j]
+    return forest_proba(features_scaled, feature, threshold, left, right, value, tree_starts)
@@ -5,10 +5,17 @@ CREATE TABLE IF NOT EXISTS users (
     id SERIAL PRIMARY KEY,
     user_id VARCHAR(50) UNIQUE NOT NULL,
     risk_score DECIMAL(3,2) DEFAULT 0.5,
+    avg_amount DECIMAL(12,4),
+    transaction_count INTEGER DEFAULT 0,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Databases created before the running-average columns existed. init.sql only runs on an
+-- empty volume, so fraud_ml/server.py also applies these columns, the trigger and the backfill on startup.
+ALTER TABLE users ADD COLUMN IF NOT EXISTS avg_amount DECIMAL(12,4);
+ALTER TABLE users ADD COLUMN IF NOT EXISTS transaction_count INTEGER DEFAULT 0;
+
 CREATE TABLE IF NOT EXISTS transactions (
     id SERIAL PRIMARY KEY,
     transaction_id VARCHAR(100) UNIQUE NOT NULL,
@@ -70,6 +77,34 @@ CREATE INDEX IF NOT EXISTS idx_transactions_amount ON transactions(amount);
 CREATE INDEX IF NOT EXISTS idx_fraud_alerts_status ON fraud_alerts(status);
 CREATE INDEX IF NOT EXISTS idx_feature_store_user_id ON feature_store(user_id);
 
+-- Backfill the running average from existing transactions (only users not yet tracked)
+UPDATE users
+SET avg_amount = history.avg_amount,
+    transaction_count = history.transaction_count
+FROM (
+    SELECT user_id, AVG(amount) AS avg_amount, COUNT(*) AS transaction_count
+    FROM transactions
+    GROUP BY user_id
+) AS history
+WHERE users.user_id = history.user_id
+  AND users.avg_amount IS NULL;
+
+-- Keep a running average amount per user so feature lookups avoid an AVG() scan
+CREATE OR REPLACE FUNCTION update_user_avg_amount() RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE users
+    SET avg_amount = (COALESCE(avg_amount, 0) * transaction_count + NEW.amount) / (transaction_count + 1),
+        transaction_count = transaction_count + 1
+    WHERE user_id = NEW.user_id;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_transactions_user_avg_amount ON transactions;
+CREATE TRIGGER trg_transactions_user_avg_amount
+    AFTER INSERT ON transactions
+    FOR EACH ROW EXECUTE FUNCTION update_user_avg_amount();
+
 -- Insert sample data
 INSERT INTO users (user_id, risk_score) VALUES 
     ('USER001', 0.3),
@@ -81,5 +116,5 @@ ON CONFLICT (user_id) DO NOTHING;
 INSERT INTO model_metadata (model_name, version, accuracy, precision, recall, f1_score, features, hyperparameters) VALUES 
     ('fraud_detection_v1', '1.0.0', 0.95, 0.92, 0.88, 0.90, 
      ARRAY['amount', 'time', 'merchant_risk', 'user_history', 'amount_to_history_ratio'],
-     '{"n_estimators": 100, "random_state": 42}')
+     '{"n_estimators": 100, "max_depth": 8, "random_state": 42}')
 ON CONFLICT DO NOTHING; 
\ No newline at end of file